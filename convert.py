@@ -1,13 +1,18 @@
 import bpy
+import copy
 import os
 import shutil
 import xml.etree.ElementTree as ET
 import re
-from xml.dom import minidom
 from bpy_extras.io_utils import ImportHelper
 from bpy.props import StringProperty
 from bpy.types import Operator
 
+try:
+    import ahocorasick  # optional: pyahocorasick, faster multi-keyword matching
+except ImportError:
+    ahocorasick = None
+
 # Target blender version: 4.x (compatible with 2.82+)
 
 ########################################################################################################################
@@ -47,37 +52,135 @@ ROAD_KEYS = [
     "nhua", "nhựa",
 ]
 
+# Precompiled keyword matchers, checked in priority order: wood -> glass -> concrete
+_WOOD_RE = re.compile("|".join(map(re.escape, WOOD_KEYS)))
+_GLASS_RE = re.compile("|".join(map(re.escape, GLASS_KEYS)))
+_ROAD_RE = re.compile("|".join(map(re.escape, ROAD_KEYS)))
+_SANITIZE_RE = re.compile(r"[^0-9A-Za-z_]+")
+
+
+def _build_keyword_automaton():
+    """Aho-Corasick automaton mapping keyword -> category priority (0 = highest)."""
+    automaton = ahocorasick.Automaton()
+    for prio, keys in enumerate((WOOD_KEYS, GLASS_KEYS, ROAD_KEYS)):
+        for k in keys:
+            if automaton.get(k, prio) >= prio:
+                automaton.add_word(k, prio)
+    automaton.make_automaton()
+    return automaton
+
+
+_CATEGORIES = ("wood", "glass", "concrete")
+_KEYWORD_AUTOMATON = _build_keyword_automaton() if ahocorasick is not None else None
+
+# Preset values pre-stringified once for SDF text nodes
+_MATERIAL_TEXT = {mkey: {k: str(v) for k, v in preset.items()} for mkey, preset in MATERIALS.items()}
+
+_LIGHTMAP_ATTRIB = {"uv_set": "1"}  # UV set 1
+
+
+def _sub(parent: ET.Element, tag: str, text: str = None, attrib: dict = None) -> ET.Element:
+    """ET.SubElement with optional text assigned in the same call."""
+    el = ET.SubElement(parent, tag, attrib or {})
+    if text is not None:
+        el.text = text
+    return el
+
+
+def _indent(elem: ET.Element, space: str = "  ", level: int = 0):
+    """Pretty-print indent in place; ET.indent on Python 3.9+, stdlib recipe on older Blender (3.7)."""
+    if hasattr(ET, "indent"):
+        ET.indent(elem, space=space)
+        return
+    i = "\n" + level * space
+    if len(elem):
+        if not elem.text or not elem.text.strip():
+            elem.text = i + space
+        if level and (not elem.tail or not elem.tail.strip()):
+            elem.tail = i
+        for child in elem:
+            _indent(child, space, level + 1)
+        if not child.tail or not child.tail.strip():
+            child.tail = i
+    elif level and (not elem.tail or not elem.tail.strip()):
+        elem.tail = i
+
+
+def _build_surface_elem(mkey: str) -> ET.Element:
+    """Build the <surface> block for a material category."""
+    preset = _MATERIAL_TEXT[mkey]
+    surface = ET.Element("surface")
+    ode = _sub(_sub(surface, "friction"), "ode")
+    _sub(ode, "mu", preset["mu"])
+    _sub(ode, "mu2", preset["mu2"])
+    if mkey == "glass":
+        _sub(ode, "slip1", "0.02")
+        _sub(ode, "slip2", "0.02")
+    bounce = _sub(surface, "bounce")
+    _sub(bounce, "restitution_coefficient", preset["restitution"])
+    _sub(bounce, "threshold", "100.0")
+    ode_c = _sub(_sub(surface, "contact"), "ode")
+    _sub(ode_c, "kp", "1e6")
+    _sub(ode_c, "kd", "1.0")
+    return surface
+
+
+# One <surface> subtree per category, deep-copied into each collision
+SURFACE_TEMPLATES = {mkey: _build_surface_elem(mkey) for mkey in MATERIALS}
+
 
 def _sanitize_name(name: str) -> str:
     s = name.strip()
-    s = re.sub(r"[^0-9A-Za-z_]+", "_", s)
+    s = _SANITIZE_RE.sub("_", s)
     if s and s[0].isdigit():
         s = f"n_{s}"
     return s
 
 
-def _pick_material(name: str) -> str:
-    n_norm = name.lower().replace(" ", "_")
-    if any(k in n_norm for k in WOOD_KEYS):
+def _normalize_name(name: str) -> str:
+    return name.lower().replace(" ", "_")
+
+
+def _pick_material_normalized(n_norm: str) -> str:
+    if _KEYWORD_AUTOMATON is not None:
+        # Keep the wood -> glass -> concrete priority regardless of match position
+        best = len(_CATEGORIES)
+        for _, prio in _KEYWORD_AUTOMATON.iter(n_norm):
+            if prio < best:
+                best = prio
+                if best == 0:
+                    break
+        return _CATEGORIES[best] if best < len(_CATEGORIES) else "default"
+    if _WOOD_RE.search(n_norm):
         return "wood"
-    if any(k in n_norm for k in GLASS_KEYS):
+    if _GLASS_RE.search(n_norm):
         return "glass"
-    if any(k in n_norm for k in ROAD_KEYS):
+    if _ROAD_RE.search(n_norm):
         return "concrete"
     return "default"
 
 
-def _add_collision_for_visual(link_el: ET.Element, visual_el: ET.Element, existing_names: set, meshes_folder_prefix: str, dae_filename: str):
-    """Create a collision sibling for given visual, copying its geometry and adding surface params."""
+def _add_collision_for_visual(visual_el: ET.Element, existing_names: set, meshes_folder_prefix: str, dae_filename: str, name_info: dict = None):
+    """Build a collision for given visual, copying its geometry and adding surface params.
+
+    ``name_info`` optionally maps visual name -> (normalized name, collision name) so
+    callers can precompute them once per object.
+
+    Returns the new <collision> element (the caller appends it right after the visual),
+    or None if no collision should be added.
+    """
     vname = visual_el.get("name", "visual")
-    col_name = _sanitize_name(f"col_{vname}")
+    info = name_info.get(vname) if name_info else None
+    if info is None:
+        info = (_normalize_name(vname), _sanitize_name(f"col_{vname}"))
+    n_norm, col_name = info
     if col_name in existing_names:
-        return False
+        return None
 
     geom = visual_el.find("geometry")
     if geom is None:
         # Visual without geometry shouldn't happen here, skip
-        return False
+        return None
 
     # Build <collision>
     collision = ET.Element("collision", attrib={"name": col_name})
@@ -87,49 +190,62 @@ def _add_collision_for_visual(link_el: ET.Element, visual_el: ET.Element, existi
     mesh = geom.find("mesh")
     if mesh is not None:
         # Deep copy the existing mesh node
-        collision_geom = ET.SubElement(collision, "geometry")
-        collision_mesh = ET.SubElement(collision_geom, "mesh")
+        collision_mesh = _sub(_sub(collision, "geometry"), "mesh")
         # uri
         uri_el = mesh.find("uri")
-        uri_text = uri_el.text if uri_el is not None else meshes_folder_prefix + dae_filename
-        uri_copy = ET.SubElement(collision_mesh, "uri")
-        uri_copy.text = uri_text
+        _sub(collision_mesh, "uri", uri_el.text if uri_el is not None else meshes_folder_prefix + dae_filename)
         # submesh
         submesh = mesh.find("submesh")
         if submesh is not None:
-            submesh_copy = ET.SubElement(collision_mesh, "submesh")
             name_node = submesh.find("name")
-            name_text = name_node.text if name_node is not None else vname
-            name_copy = ET.SubElement(submesh_copy, "name")
-            name_copy.text = name_text
+            _sub(_sub(collision_mesh, "submesh"), "name", name_node.text if name_node is not None else vname)
     else:
         # Fallback: copy whole geometry
-        collision.append(ET.fromstring(ET.tostring(geom)))
-
-    # Surface parameters based on heuristic
-    mkey = _pick_material(vname)
-    preset = MATERIALS[mkey]
-    surface = ET.SubElement(collision, "surface")
-    friction = ET.SubElement(surface, "friction")
-    ode = ET.SubElement(friction, "ode")
-    ET.SubElement(ode, "mu").text = str(preset["mu"])
-    ET.SubElement(ode, "mu2").text = str(preset["mu2"])
-    if mkey == "glass":
-        ET.SubElement(ode, "slip1").text = "0.02"
-        ET.SubElement(ode, "slip2").text = "0.02"
-    bounce = ET.SubElement(surface, "bounce")
-    ET.SubElement(bounce, "restitution_coefficient").text = str(preset["restitution"])
-    ET.SubElement(bounce, "threshold").text = "100.0"
-    contact = ET.SubElement(surface, "contact")
-    ode_c = ET.SubElement(contact, "ode")
-    ET.SubElement(ode_c, "kp").text = "1e6"
-    ET.SubElement(ode_c, "kd").text = "1.0"
-
-    # Insert right after the visual element for readability
-    idx = list(link_el).index(visual_el) + 1
-    link_el.insert(idx, collision)
+        collision.append(copy.deepcopy(geom))
+
+    # Surface parameters based on heuristic (copied from the per-category template)
+    mkey = _pick_material_normalized(n_norm)
+    collision.append(copy.deepcopy(SURFACE_TEMPLATES[mkey]))
+
     existing_names.add(col_name)
-    return True
+    return collision
+
+
+def _base_color_texture(material, image_path_cache: dict = None):
+    """Return (absolute texture path, basename) of the Principled BSDF Base Color image.
+
+    The path is None when the material has no image texture; the basename is None
+    when the image file does not exist on disk. ``image_path_cache`` optionally maps
+    image.name_full -> result so images shared by several materials resolve once.
+    """
+    if not material.node_tree:
+        return None, None
+    nodes = material.node_tree.nodes
+    principled = nodes.get("Principled BSDF")
+    if principled is None or principled.type != 'BSDF_PRINCIPLED':
+        principled = next((n for n in nodes if n.type == 'BSDF_PRINCIPLED'), None)
+    if principled is None:
+        return None, None
+    base_color = principled.inputs.get('Base Color')
+    if not (base_color and base_color.links):
+        return None, None
+    link_node = base_color.links[0].from_node
+    if not (hasattr(link_node, 'image') and link_node.image):
+        return None, None
+    image = link_node.image
+    if image_path_cache is not None and image.name_full in image_path_cache:
+        return image_path_cache[image.name_full]
+    texture_path = bpy.path.abspath(image.filepath)
+    if os.path.isfile(texture_path):
+        result = (texture_path, os.path.basename(texture_path))
+    else:
+        print(f"Texture path không hợp lệ: {texture_path}")
+        result = (texture_path, None)
+    if image_path_cache is not None:
+        image_path_cache[image.name_full] = result
+    return result
+
+
 def export_sdf(prefix_path):
     dae_filename = 'model.dae'  # Giữ nguyên theo yêu cầu
     sdf_filename = 'model.sdf'  # Giữ nguyên theo yêu cầu
@@ -142,31 +258,58 @@ def export_sdf(prefix_path):
     meshes_path = os.path.join(prefix_path, meshes_folder_prefix)
     os.makedirs(meshes_path, exist_ok=True)
 
+    # Lấy danh sách mesh một lần, dùng chung cho bước texture và bước SDF
+    mesh_objects = [o for o in bpy.context.selectable_objects if o.type == 'MESH']
+
     # Thu thập và sao chép texture từ Principled BSDF
     texture_files = set()  # Lưu danh sách texture để sao chép
-    for obj in bpy.context.selectable_objects:
-        if obj.type == 'MESH' and obj.active_material and obj.active_material.node_tree:
-            nodes = obj.active_material.node_tree.nodes
-            principled = next((n for n in nodes if n.type == 'BSDF_PRINCIPLED'), None)
-            if principled and principled.inputs.get('Base Color') and principled.inputs['Base Color'].links:
-                link_node = principled.inputs['Base Color'].links[0].from_node
-                if hasattr(link_node, 'image') and link_node.image:
-                    texture_path = bpy.path.abspath(link_node.image.filepath)
-                    if os.path.isfile(texture_path):
-                        texture_files.add(texture_path)
-                    else:
-                        print(f"Texture path không hợp lệ: {texture_path}")
-
-    # Sao chép texture vào thư mục meshes
+    material_cache = {}  # material.name_full -> (texture_path, basename), dùng chung cho các mesh
+    image_path_cache = {}  # image.name_full -> (texture_path, basename), dùng chung cho các material
+    for obj in mesh_objects:
+        if obj.active_material:
+            mat = obj.active_material
+            if mat.name_full not in material_cache:
+                material_cache[mat.name_full] = _base_color_texture(mat, image_path_cache)
+            texture_path, basename = material_cache[mat.name_full]
+            if basename:
+                texture_files.add(texture_path)
+
+    # Tên file đích trong meshes cho mỗi texture, tính một lần cho cả bước sao chép và bước SDF
+    tex_dest = {texture_path: os.path.basename(texture_path)
+                for texture_path, _ in material_cache.values() if texture_path}
+
+    # Sao chép texture vào thư mục meshes; ghi lại tên đích đã sao chép hoặc đã cập nhật
+    # (không so tên với os.listdir vì hệ file Windows/macOS không phân biệt hoa thường)
+    copied_textures = set()
     for texture_path in texture_files:
         try:
-            destination = os.path.join(meshes_path, os.path.basename(texture_path))
-            shutil.copy2(texture_path, destination)
-            print(f"Đã sao chép texture: {os.path.basename(texture_path)} vào {meshes_path}")
+            destination = os.path.join(meshes_path, tex_dest[texture_path])
+            # Bỏ qua nếu bản sao đích đã cập nhật (cùng kích thước, không cũ hơn nguồn)
+            try:
+                src_stat = os.stat(texture_path)
+                dst_stat = os.stat(destination)
+                if dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime >= src_stat.st_mtime:
+                    copied_textures.add(tex_dest[texture_path])
+                    continue
+            except FileNotFoundError:
+                pass
+            shutil.copyfile(texture_path, destination)  # chỉ cần nội dung, bỏ copystat
+            copied_textures.add(tex_dest[texture_path])
+            print(f"Đã sao chép texture: {tex_dest[texture_path]} vào {meshes_path}")
         except Exception as e:
             print(f"Lỗi khi sao chép texture {texture_path}: {e}")
 
-    # Export DAE với tối ưu hóa
+    # Export DAE với tối ưu hóa: chỉ chọn các mesh (kèm chuỗi parent để giữ đúng transform)
+    # để exporter bỏ qua light/camera/empty không liên quan
+    view_layer_objects = bpy.context.view_layer.objects
+    prev_selection = [o for o in view_layer_objects if o.select_get()]
+    export_set = set()
+    for o in mesh_objects:
+        while o is not None and o not in export_set:
+            export_set.add(o)
+            o = o.parent
+    for o in view_layer_objects:
+        o.select_set(o in export_set)
     try:
         bpy.ops.wm.collada_export(
             filepath=os.path.join(meshes_path, dae_filename),
@@ -193,15 +336,21 @@ def export_sdf(prefix_path):
             filter_btx=False,
             filter_collada=True,
             filter_folder=True,
-            filemode=8
+            filemode=8,
+            selected=True
         )
         print(f"Đã xuất DAE thành công vào: {os.path.join(meshes_path, dae_filename)}")
     except Exception as e:
         print(f"Lỗi khi xuất DAE: {e}")
         return
+    finally:
+        # Khôi phục trạng thái chọn ban đầu
+        prev_set = set(prev_selection)
+        for o in view_layer_objects:
+            o.select_set(o in prev_set)
 
-    objects = bpy.context.selectable_objects
-    mesh_objects = [o for o in objects if o.type == 'MESH']
+    # Tên chuẩn hóa và tên collision tính một lần cho mỗi object
+    name_info = {o.name: (_normalize_name(o.name), _sanitize_name(f"col_{o.name}")) for o in mesh_objects}
 
     #############################################
     #### Xuất SDF xml dựa trên scene ############
@@ -212,56 +361,53 @@ def export_sdf(prefix_path):
     model = ET.SubElement(sdf, "model", attrib={"name": model_name})
     
     # Static mặc định true (giữ tĩnh theo yêu cầu)
-    static = ET.SubElement(model, "static")
-    static.text = "true"
+    _sub(model, "static", "true")
 
     link = ET.SubElement(model, "link", attrib={"name": "testlink"})
 
+    # Liệt kê thư mục meshes một lần thay vì gọi isfile cho từng visual
+    # (dùng cho texture không sao chép được nhưng đã có sẵn trong meshes)
+    present = {os.path.normcase(n) for n in os.listdir(meshes_path)}
+    mesh_uri = meshes_folder_prefix + dae_filename
+
+    # Kiểm tra lightmap một lần (trạng thái file không đổi trong lúc xuất)
+    lightmap_full_path = os.path.join(meshes_path, lightmap_filename)
+    has_lightmap = os.path.isfile(lightmap_full_path)
+    lightmap_uri = meshes_folder_prefix + lightmap_filename if has_lightmap else None
+    if not has_lightmap:
+        print(f"Lightmap {lightmap_filename} không tìm thấy trong {meshes_path}")
+
     # Thêm <visual> cho mỗi mesh và tự động thêm <collision> tương ứng
     existing_collision_names = set()
     for o in mesh_objects:
         visual = ET.SubElement(link, "visual", attrib={"name": o.name})
 
-        geometry = ET.SubElement(visual, "geometry")
-        mesh = ET.SubElement(geometry, "mesh")
-        uri = ET.SubElement(mesh, "uri")
-        uri.text = meshes_folder_prefix + dae_filename
-        submesh = ET.SubElement(mesh, "submesh")
-        submesh_name = ET.SubElement(submesh, "name")
-        submesh_name.text = o.name
+        mesh = _sub(_sub(visual, "geometry"), "mesh")
+        _sub(mesh, "uri", mesh_uri)
+        _sub(_sub(mesh, "submesh"), "name", o.name)
         
         # Kiểm tra và thêm material chỉ khi có texture
         diffuse_map = ""
         metal_node = None
-        if o.active_material and o.active_material.node_tree:
-            nodes = o.active_material.node_tree.nodes
-            principled = next((n for n in nodes if n.type == 'BSDF_PRINCIPLED'), None)
-            if principled:
-                base_color = principled.inputs.get('Base Color')
-                if base_color and base_color.links:
-                    link_node = base_color.links[0].from_node
-                    if hasattr(link_node, 'image') and link_node.image:
-                        texture_path = bpy.path.abspath(link_node.image.filepath)
-                        if os.path.isfile(os.path.join(meshes_path, os.path.basename(texture_path))):
-                            diffuse_map = os.path.basename(texture_path)
-                        else:
-                            print(f"Texture {texture_path} không tìm thấy trong {meshes_path}")
+        if o.active_material:
+            texture_path, _ = material_cache.get(o.active_material.name_full, (None, None))
+            dest_name = tex_dest.get(texture_path)
+            if dest_name:
+                if dest_name in copied_textures or os.path.normcase(dest_name) in present:
+                    diffuse_map = dest_name
+                else:
+                    print(f"Texture {texture_path} không tìm thấy trong {meshes_path}")
 
         # Thêm material chỉ khi có texture
         if diffuse_map:
-            material = ET.SubElement(visual, "material")
-            diffuse = ET.SubElement(material, "diffuse")
-            diffuse.text = "1.0 1.0 1.0 1.0"  # Giữ sáng
-            specular = ET.SubElement(material, "specular")
-            specular.text = "0.0 0.0 0.0 1.0"
-            pbr = ET.SubElement(material, "pbr")
-            metal_node = ET.SubElement(pbr, "metal")
-            albedo_map = ET.SubElement(metal_node, "albedo_map")
-            albedo_map.text = meshes_folder_prefix + diffuse_map
+            material = _sub(visual, "material")
+            _sub(material, "diffuse", "1.0 1.0 1.0 1.0")  # Giữ sáng
+            _sub(material, "specular", "0.0 0.0 0.0 1.0")
+            metal_node = _sub(_sub(material, "pbr"), "metal")
+            _sub(metal_node, "albedo_map", meshes_folder_prefix + diffuse_map)
         
-        # Kiểm tra lightmap (tùy chọn)
-        lightmap_full_path = os.path.join(meshes_path, lightmap_filename)
-        if os.path.isfile(lightmap_full_path):
+        # Thêm lightmap (tùy chọn)
+        if has_lightmap:
             # Đảm bảo có pbr/metal để đặt light_map, nếu chưa có thì tạo tối thiểu
             if metal_node is None:
                 material = visual.find("material")
@@ -271,45 +417,42 @@ def export_sdf(prefix_path):
                 if pbr is None:
                     pbr = ET.SubElement(material, "pbr")
                 metal_node = ET.SubElement(pbr, "metal")
-            light_map = ET.SubElement(metal_node, "light_map", attrib={"uv_set": "1"})  # UV set 1
-            light_map.text = meshes_folder_prefix + lightmap_filename
-            cast_shadows = ET.SubElement(visual, "cast_shadows")
-            cast_shadows.text = "0"  # Tắt bóng
-        else:
-            print(f"Lightmap {lightmap_filename} không tìm thấy trong {meshes_path}")
+            _sub(metal_node, "light_map", lightmap_uri, _LIGHTMAP_ATTRIB)
+            _sub(visual, "cast_shadows", "0")  # Tắt bóng
 
         # Tự động thêm collision dựa trên visual vừa tạo
-        _add_collision_for_visual(link, visual, existing_collision_names, meshes_folder_prefix, dae_filename)
+        # (visual vừa được append vào cuối link nên append collision ngay sau nó)
+        collision = _add_collision_for_visual(visual, existing_collision_names, meshes_folder_prefix, dae_filename, name_info)
+        if collision is not None:
+            link.append(collision)
 
     # Không thêm <light> (đã thêm <collision> tự động ở trên)
 
     # Ghi SDF vào file
     try:
-        xml_string = ET.tostring(sdf, encoding='unicode')
-        reparsed = minidom.parseString(xml_string)
-        with open(os.path.join(prefix_path, sdf_filename), "w") as sdf_file:
-            sdf_file.write(reparsed.toprettyxml(indent="  "))
+        _indent(sdf, space="  ")
+        # Ghi trực tiếp ra file (bytes), không dựng chuỗi XML trung gian trong bộ nhớ;
+        # buffer 1 MiB để gom các mẩu nhỏ của ElementTree.write thành ít lần ghi đĩa
+        with open(os.path.join(prefix_path, sdf_filename), "wb", buffering=1 << 20) as sdf_file:
+            ET.ElementTree(sdf).write(sdf_file, encoding="utf-8", xml_declaration=True, short_empty_elements=True)
     except Exception as e:
         print(f"Lỗi khi ghi SDF: {e}")
         return
 
-    # Tạo model.config
-    config_model = ET.Element('model')
-    name_elem = ET.SubElement(config_model, 'name')
-    name_elem.text = model_name
-    version = ET.SubElement(config_model, 'version')
-    version.text = "1.0"
-    sdf_tag = ET.SubElement(config_model, "sdf", attrib={"version": "1.8"})
-    sdf_tag.text = sdf_filename
-    author = ET.SubElement(config_model, 'author')
-    author_name = ET.SubElement(author, 'name')
-    author_name.text = "Generated by blender SDF tools"
-
+    # Tạo model.config (file nhỏ, ghi trực tiếp không cần dựng cây XML)
     try:
-        xml_string = ET.tostring(config_model, encoding='unicode')
-        reparsed = minidom.parseString(xml_string)
-        with open(os.path.join(prefix_path, model_config_filename), "w") as config_file:
-            config_file.write(reparsed.toprettyxml(indent="  "))
+        with open(os.path.join(prefix_path, model_config_filename), "w", encoding="utf-8") as config_file:
+            config_file.write(
+                '<?xml version="1.0"?>\n'
+                '<model>\n'
+                f'  <name>{model_name}</name>\n'
+                '  <version>1.0</version>\n'
+                f'  <sdf version="1.8">{sdf_filename}</sdf>\n'
+                '  <author>\n'
+                '    <name>Generated by blender SDF tools</name>\n'
+                '  </author>\n'
+                '</model>\n'
+            )
     except Exception as e:
         print(f"Lỗi khi ghi model.config: {e}")
         return